@@ -13,8 +13,9 @@ warnings.filterwarnings('ignore', message='.*OpenSSL.*')
 
 # Auto-install missing dependencies BEFORE importing them
 required_packages = {
-    'requests': 'requests',
-    'bs4': 'beautifulsoup4',
+    'aiohttp': 'aiohttp',
+    'aiofiles': 'aiofiles',
+    'lxml': 'lxml',
     'tqdm': 'tqdm',
     'PIL': 'Pillow'
 }
@@ -40,18 +41,31 @@ if missing_packages:
 
 # Now import all required packages
 import re
-import time
-import requests
-from datetime import datetime
+import asyncio
+import aiohttp
+import aiofiles
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
 from pathlib import Path
-from urllib.parse import urlparse
 from zoneinfo import ZoneInfo
-from bs4 import BeautifulSoup
+from lxml import etree
 from tqdm import tqdm
 import zipfile
 import shutil
+import struct
+import zlib
 import subprocess
-from PIL import Image
+import threading
+from dataclasses import dataclass, field
+from concurrent.futures import ThreadPoolExecutor
+from PIL import Image, ImageFile
+
+# Snapchat exports contain the odd huge or truncated image, don't abort on them
+Image.MAX_IMAGE_PIXELS = None
+ImageFile.LOAD_TRUNCATED_IMAGES = True
+
+# Image.Resampling only exists since Pillow 9.1, older Pillow / Pillow-SIMD builds lack it
+LANCZOS = getattr(Image, 'Resampling', Image).LANCZOS
 
 # Configuration
 OUTPUT_DIR = Path("downloaded_memories")
@@ -60,135 +74,495 @@ HTML_FILE = "html/memories_history.html"
 # Change timezone if needed: 'America/New_York', 'Europe/London', 'Asia/Tokyo', etc.
 LOCAL_TIMEZONE = ZoneInfo('Europe/Oslo')
 
+# Number of memories downloaded at the same time
+MAX_CONCURRENCY = 8
+
+# Video merges (ffmpeg) running at the same time, each one keeps CPU cores busy
+VIDEO_WORKERS = max(1, (os.cpu_count() or 2) // 2)
+
+# HTTP settings shared by all requests
+USER_AGENT = 'SnapMemory-Kit/1.0.0'
+REQUEST_TIMEOUT = aiohttp.ClientTimeout(sock_connect=5, sock_read=30)
+MAX_RETRIES = 3
+RETRY_BACKOFF = 0.3  # Seconds, doubled after every attempt
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+RETRY_AFTER_STATUSES = {429, 503}  # Retry-After is honoured for these
+MAX_RETRY_AFTER = 60  # Seconds, waits hold a download slot so keep them short
+
+# Large files are fetched as parallel HTTP Range requests of this size
+CHUNK_SIZE = 2 * 1024 * 1024
+RANGE_CONNECTIONS = 4  # Range requests running at the same time per file
+
+# Used for every row of the export, so only built once
+_URL_RE = re.compile(r"downloadMemories\('([^']+)'")
+_UTC = ZoneInfo('UTC')
+
+
+def _parse_utc_date(date_str):
+    """Parse "2025-12-16 08:59:40 UTC" (fromisoformat is much faster than strptime)"""
+    if len(date_str) != 23 or not date_str.endswith(' UTC'):
+        raise ValueError(f"unexpected date format: {date_str}")
+    return datetime.fromisoformat(date_str[:19]).replace(tzinfo=_UTC)
+
+
+_MEDIA_EXTENSIONS = {'jpg', 'jpeg', 'png', 'mp4', 'mov'}
+
+
+def _guess_ext(url, media_type):
+    """Determine file extension based on URL and media type"""
+    # Try to get from URL path (without the query string)
+    ext = url.rsplit('?', 1)[0].rsplit('.', 1)[-1].lower()
+    if ext in _MEDIA_EXTENSIONS:
+        return ext
+
+    # Fallback to media type
+    media_type = media_type.lower()
+    if media_type == 'image':
+        return 'jpg'
+    elif media_type == 'video':
+        return 'mp4'
+    return 'dat'
+
+
+def _retry_after(response):
+    """Seconds to wait from a Retry-After header, None if there is none"""
+    value = response.headers.get('Retry-After', '').strip()
+    if value.isdigit():
+        return int(value)
+
+    # Otherwise an HTTP date, e.g. "Wed, 21 Oct 2026 07:28:00 GMT"
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if retry_at.tzinfo is None:
+        retry_at = retry_at.replace(tzinfo=timezone.utc)
+    return max(0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+
+
+def _content_range_total(response):
+    """Total file size from a 206 Content-Range header, None if unknown"""
+    # Format: "bytes 0-2097151/52428800"
+    _, _, total = response.headers.get('Content-Range', '').rpartition('/')
+    return int(total) if total.isdigit() else None
+
+
+def _content_range_start(response):
+    """First byte of a 206 Content-Range header, None if unknown"""
+    unit, _, byte_range = response.headers.get('Content-Range', '').partition(' ')
+    start = byte_range.partition('-')[0]
+    return int(start) if unit == 'bytes' and start.isdigit() else None
+
+
+def _preallocate(f, size):
+    """Reserve size bytes on disk so chunks can be written at any offset"""
+    if hasattr(os, 'posix_fallocate'):
+        try:
+            os.posix_fallocate(f.fileno(), 0, size)
+            return
+        except OSError:
+            pass  # Not supported by this filesystem
+    f.truncate(size)
+
+
+def _write_at(f, offset, data):
+    """Write data at offset without moving a shared file position"""
+    if hasattr(os, 'pwrite'):
+        os.pwrite(f.fileno(), data, offset)
+    else:
+        # Windows has no pwrite - safe since all writes happen on the event loop
+        f.seek(offset)
+        f.write(data)
+
+
+def _detect_video_encoder():
+    """Pick a hardware H.264 encoder that ffmpeg supports, else libx264"""
+    if sys.platform == 'darwin':
+        return 'h264_videotoolbox'
+
+    try:
+        result = subprocess.run(['ffmpeg', '-hide_banner', '-encoders'],
+                                capture_output=True, text=True, check=False)
+    except OSError:
+        return 'libx264'  # ffmpeg not installed, merges will fail anyway
+
+    # Being compiled in doesn't mean the GPU is there, merge_video_with_overlay
+    # falls back to libx264 if the encoder fails
+    for encoder in ['h264_nvenc', 'h264_qsv']:
+        if encoder in result.stdout:
+            return encoder
+    return 'libx264'
+
+
+def _cell_text(cell):
+    """Text of a table cell, stripped like bs4's get_text(strip=True)"""
+    return ''.join(text.strip() for text in cell.itertext())
+
+
+@dataclass
+class MemoryTable:
+    """Parsed memories, stored column by column
+
+    Memory i is date_local[i], media_type[i], ... One list per field is
+    much smaller than one dict per memory on exports with 100k+ memories.
+    """
+    date_local: list = field(default_factory=list)
+    media_type: list = field(default_factory=list)
+    latitude: list = field(default_factory=list)
+    longitude: list = field(default_factory=list)
+    url: list = field(default_factory=list)
+    date_str: list = field(default_factory=list)
+    stem: list = field(default_factory=list)  # Filename without extension
+    ext: list = field(default_factory=list)
+
+    def append(self, date_local, media_type, latitude, longitude, url, date_str):
+        self.date_local.append(date_local)
+        self.media_type.append(media_type)
+        self.latitude.append(latitude)
+        self.longitude.append(longitude)
+        self.url.append(url)
+        self.date_str.append(date_str)
+        # Format: 2024-12-16_085940
+        self.stem.append(date_local.strftime("%Y-%m-%d_%H%M%S"))
+        self.ext.append(_guess_ext(url, media_type))
+
+    def __len__(self):
+        return len(self.url)
+
+
+class _MemoryZip:
+    """Minimal reader for the small ZIPs memories come in (main file + overlay)
+
+    Walks the local file headers from the start of the file instead of
+    seeking to the central directory at the end like zipfile does. Entries
+    it can't stream (data descriptors, encryption, ZIP64, other compression
+    methods) are handed to zipfile instead.
+    """
+
+    # signature, version, flags, method, time, date, crc, compressed size,
+    # uncompressed size, name length, extra field length
+    HEADER = struct.Struct('<4sHHHHHIIIHH')
+    SIGNATURE = b'PK\x03\x04'
+
+    def __init__(self, filepath):
+        self._file = open(filepath, 'rb')
+        self._entries = {}  # name -> (data offset, compressed size, method, crc)
+        self._zip = None
+
+        try:
+            if not self._read_headers():
+                self._file.seek(0)
+                self._zip = zipfile.ZipFile(self._file)
+        except Exception:
+            self._file.close()
+            raise
+
+    def _read_headers(self):
+        """Index all entries, returns False if zipfile is needed"""
+        while True:
+            header = self._file.read(self.HEADER.size)
+            if len(header) < self.HEADER.size or header[:4] != self.SIGNATURE:
+                break  # Reached the central directory
+
+            (_, _, flags, method, _, _, crc, compressed_size, _,
+             name_length, extra_length) = self.HEADER.unpack(header)
+
+            # Bit 0: encrypted, bit 3: sizes only known after the data
+            if (flags & 0x09 or compressed_size == 0xFFFFFFFF
+                    or method not in [zipfile.ZIP_STORED, zipfile.ZIP_DEFLATED]):
+                return False
+
+            name = self._file.read(name_length).decode('utf-8' if flags & 0x800 else 'cp437')
+            data_offset = self._file.tell() + extra_length
+            self._entries[name] = (data_offset, compressed_size, method, crc)
+            self._file.seek(data_offset + compressed_size)
+
+        if not self._entries:
+            raise zipfile.BadZipFile("File is not a zip file")
+        return True
+
+    def namelist(self):
+        if self._zip:
+            return self._zip.namelist()
+        return list(self._entries)
+
+    def extract_to(self, name, destination):
+        """Stream one entry into destination, removing it again if that fails"""
+        try:
+            if self._zip:
+                with self._zip.open(name) as src, open(destination, 'wb') as dst:
+                    shutil.copyfileobj(src, dst, length=1 << 20)
+            else:
+                self._stream_entry(name, destination)
+        except BaseException:
+            # Half-written file would count as downloaded (see _existing_files)
+            destination.unlink(missing_ok=True)
+            raise
+
+    def _stream_entry(self, name, destination):
+        """Stream an entry found by _read_headers, checking its CRC-32"""
+        data_offset, remaining, method, expected_crc = self._entries[name]
+        decompressor = zlib.decompressobj(-15) if method == zipfile.ZIP_DEFLATED else None
+        crc = 0
+        self._file.seek(data_offset)
+
+        with open(destination, 'wb') as dst:
+            while remaining:
+                data = self._file.read(min(remaining, 1 << 20))
+                if not data:
+                    raise zipfile.BadZipFile(f"Truncated entry: {name}")
+                remaining -= len(data)
+                if decompressor:
+                    data = decompressor.decompress(data)
+                crc = zlib.crc32(data, crc)
+                dst.write(data)
+
+            if decompressor:
+                data = decompressor.flush()
+                crc = zlib.crc32(data, crc)
+                dst.write(data)
+
+        if crc != expected_crc:
+            raise zipfile.BadZipFile(f"Bad CRC-32 for entry: {name}")
+
+    def close(self):
+        if self._zip:
+            self._zip.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
 
 class SnapchatMemoryDownloader:
-    def __init__(self, html_file, output_dir):
+    def __init__(self, html_file, output_dir, max_concurrency=MAX_CONCURRENCY):
         self.html_file = html_file
         self.output_dir = Path(output_dir)
-        self.memories = []
-        self.session = requests.Session()
+        self.memories = MemoryTable()
+        self.max_concurrency = max_concurrency
+        # Persistent exiftool process, started on first use (see _run_exiftool)
+        self._exiftool = None
+        self._exiftool_lock = threading.Lock()
+        # Folders already created this run, saves a mkdir per file
+        self._created_dirs = set()
+        # H.264 encoder for video merges, hardware if available
+        self._vcodec = _detect_video_encoder()
 
     def parse_html(self):
         """Parse the HTML file and extract all memories"""
         print("Parsing HTML file...")
 
-        with open(self.html_file, 'r', encoding='utf-8') as f:
-            content = f.read()
+        # Stream the rows instead of building a tree of the whole export
+        with open(self.html_file, 'rb') as f:
+            rows = etree.iterparse(f, html=True, tag='tr', encoding='utf-8')
+            for row_number, (_, row) in enumerate(rows):
+                if row_number > 0:  # Skip header row
+                    self._parse_row(row)
 
-        soup = BeautifulSoup(content, 'html.parser')
-        rows = soup.find_all('tr')
+                # Free the row and the rows before it, memory use stays flat
+                row.clear()
+                while row.getprevious() is not None:
+                    del row.getparent()[0]
 
-        for row in rows[1:]:  # Skip header row
-            cols = row.find_all('td')
-            if len(cols) < 4:
-                continue
+        print(f"Found {len(self.memories)} memories to download")
+        print("=" * 60)
+        return self.memories
 
-            date_str = cols[0].get_text(strip=True)
-            media_type = cols[1].get_text(strip=True)
-            location_str = cols[2].get_text(strip=True)
+    def _parse_row(self, row):
+        """Parse one table row, adding it to self.memories if it is a memory"""
+        cols = row.findall('td')
+        if len(cols) < 4:
+            return
 
-            # Find download link
-            link = cols[3].find('a', {'onclick': True})
-            if not link:
-                continue
+        date_str = _cell_text(cols[0])
+        media_type = _cell_text(cols[1])
+        location_str = _cell_text(cols[2])
 
-            # Extract URL from onclick attribute
-            onclick = link.get('onclick', '')
-            url_match = re.search(r"downloadMemories\('([^']+)'", onclick)
-            if not url_match:
-                continue
+        # Find download link
+        link = cols[3].find('.//a[@onclick]')
+        if link is None:
+            return
 
-            url = url_match.group(1)
+        # Extract URL from onclick attribute
+        onclick = link.get('onclick', '')
+        url_match = _URL_RE.search(onclick)
+        if not url_match:
+            return
 
-            # Parse date (format: "2025-12-16 08:59:40 UTC")
-            try:
-                utc_date = datetime.strptime(date_str, "%Y-%m-%d %H:%M:%S UTC")
-                utc_date = utc_date.replace(tzinfo=ZoneInfo('UTC'))
-                # Convert to local timezone
-                local_date = utc_date.astimezone(LOCAL_TIMEZONE)
-            except ValueError:
-                print(f"WARNING: Could not parse date: {date_str}")
-                continue
+        url = url_match.group(1)
 
-            # Parse GPS coordinates
-            lat, lon = None, None
-            if "Latitude, Longitude:" in location_str:
-                coords = location_str.replace("Latitude, Longitude:", "").strip()
-                try:
-                    lat, lon = map(float, coords.split(','))
-                except (ValueError, AttributeError):
-                    pass
-
-            memory = {
-                'date_utc': utc_date,
-                'date_local': local_date,
-                'media_type': media_type,
-                'latitude': lat,
-                'longitude': lon,
-                'url': url,
-                'date_str': date_str
-            }
-
-            self.memories.append(memory)
+        # Parse date (format: "2025-12-16 08:59:40 UTC")
+        try:
+            utc_date = _parse_utc_date(date_str)
+            # Convert to local timezone
+            local_date = utc_date.astimezone(LOCAL_TIMEZONE)
+        except ValueError:
+            print(f"WARNING: Could not parse date: {date_str}")
+            return
 
-        print(f"Found {len(self.memories)} memories to download")
-        print("=" * 60)
-        return self.memories
+        # Parse GPS coordinates
+        lat, lon = None, None
+        if "Latitude, Longitude:" in location_str:
+            coords = location_str.replace("Latitude, Longitude:", "").strip()
+            try:
+                lat, lon = map(float, coords.split(','))
+            except (ValueError, AttributeError):
+                pass
 
-    def get_file_extension(self, url, media_type):
-        """Determine file extension based on URL and media type"""
-        # Try to get from URL
-        parsed = urlparse(url)
-        path = parsed.path
-        if '.' in path:
-            ext = path.split('.')[-1].lower()
-            if ext in ['jpg', 'jpeg', 'png', 'mp4', 'mov']:
-                return ext
-
-        # Fallback to media type
-        if media_type.lower() == 'image':
-            return 'jpg'
-        elif media_type.lower() == 'video':
-            return 'mp4'
-        return 'dat'
-
-    def create_filename(self, memory):
+        self.memories.append(local_date, media_type, lat, lon, url, date_str)
+
+    def create_filename(self, i):
         """Create a filename based on date and time"""
-        date = memory['date_local']
-        # Format: 2024-12-16_085940
-        filename = date.strftime("%Y-%m-%d_%H%M%S")
-        ext = self.get_file_extension(memory['url'], memory['media_type'])
-        return f"{filename}.{ext}"
-
-    def get_output_path(self, memory):
-        """Get the full output path for a memory"""
-        date = memory['date_local']
-        year = date.strftime("%Y")
+        # Both worked out once in parse_html
+        return f"{self.memories.stem[i]}.{self.memories.ext[i]}"
+
+    def _ensure_dir(self, folder):
+        """Create folder (and parents) unless it was already created this run"""
+        if folder not in self._created_dirs:
+            folder.mkdir(parents=True, exist_ok=True)
+            self._created_dirs.add(folder)
+
+    def get_output_path(self, i):
+        """Get the full output path for memory i"""
+        year = self.memories.stem[i][:4]
         folder = self.output_dir / year
-        folder.mkdir(parents=True, exist_ok=True)
+        self._ensure_dir(folder)
 
-        filename = self.create_filename(memory)
+        filename = self.create_filename(i)
         return folder / filename
 
-    def download_file(self, url, output_path):
+    async def _get(self, session, url, headers=None):
+        """GET url, retrying connection errors and 429/5xx answers with backoff"""
+        for attempt in range(MAX_RETRIES + 1):
+            delay = None
+            try:
+                response = await session.get(url, headers=headers)
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError):
+                if attempt == MAX_RETRIES:
+                    raise
+            else:
+                if response.status not in RETRY_STATUSES or attempt == MAX_RETRIES:
+                    return response
+                if response.status in RETRY_AFTER_STATUSES:
+                    delay = _retry_after(response)
+                    if delay is not None:
+                        delay = min(delay, MAX_RETRY_AFTER)
+                response.release()
+
+            # As urllib3's Retry: the server's Retry-After wins over our backoff
+            await asyncio.sleep(RETRY_BACKOFF * 2 ** attempt if delay is None else delay)
+
+    async def _stream_to_file(self, response, output_path):
+        """Stream a response body to output_path without blocking the event loop"""
+        async with aiofiles.open(output_path, 'wb') as f:
+            async for chunk in response.content.iter_chunked(65536):
+                await f.write(chunk)
+
+    async def _download_ranges(self, session, url, output_path, first_chunk, total_size):
+        """Fetch the rest of a file with parallel Range requests
+
+        Returns False if the server answers with 200 instead of 206.
+        """
+        ranges = [(start, min(start + CHUNK_SIZE, total_size) - 1)
+                  for start in range(len(first_chunk), total_size, CHUNK_SIZE)]
+        sem = asyncio.Semaphore(RANGE_CONNECTIONS)
+
+        with open(output_path, 'wb', buffering=0) as f:
+            _preallocate(f, total_size)
+            _write_at(f, 0, first_chunk)
+
+            async def fetch(start, end):
+                async with sem:
+                    # Servers may answer with less than asked for (e.g. CDNs
+                    # capping range size) - ask again for the rest until done
+                    offset = start
+                    while offset <= end:
+                        headers = {'Range': f'bytes={offset}-{end}'}
+                        async with await self._get(session, url, headers) as response:
+                            response.raise_for_status()
+                            if response.status != 206:
+                                return False
+                            if _content_range_start(response) != offset:
+                                raise aiohttp.ClientPayloadError(
+                                    f"Asked for bytes {offset}-{end}, got "
+                                    f"{response.headers.get('Content-Range')}")
+
+                            received = offset
+                            async for chunk in response.content.iter_chunked(65536):
+                                chunk = chunk[:end + 1 - offset]  # Ignore anything past end
+                                _write_at(f, offset, chunk)
+                                offset += len(chunk)
+
+                        if offset == received:
+                            raise aiohttp.ClientPayloadError(f"Empty answer for bytes {offset}-{end}")
+                    return True
+
+            # Let every chunk finish before the file is closed, then re-raise
+            results = await asyncio.gather(*(fetch(start, end) for start, end in ranges),
+                                           return_exceptions=True)
+
+        for result in results:
+            if isinstance(result, BaseException):
+                raise result
+        return all(results)
+
+    async def download_file(self, session, url, output_path):
         """Download a file from URL to output_path"""
+        # Download under a name _existing_files doesn't match, so a download
+        # that fails or is interrupted (Ctrl-C) never counts as finished
+        partial_path = output_path.with_name(f"_partial_{output_path.name}")
         try:
-            response = self.session.get(url, timeout=30, stream=True)
-            response.raise_for_status()
-
-            # Write file
-            with open(output_path, 'wb') as f:
-                for chunk in response.iter_content(chunk_size=8192):
-                    f.write(chunk)
-
+            await self._fetch(session, url, partial_path)
+            os.replace(partial_path, output_path)
             return True
         except Exception as e:
             print(f"\nWARNING: Failed to download: {e}")
             return False
+        finally:
+            partial_path.unlink(missing_ok=True)
+
+    async def _fetch(self, session, url, output_path):
+        """Fetch URL into output_path, in parallel ranges if it is large"""
+        # Ask for the first chunk only - a 206 answer tells us the total
+        # size, so the rest of a large file can be fetched in parallel
+        headers = {'Range': f'bytes=0-{CHUNK_SIZE - 1}'}
+        async with await self._get(session, url, headers) as response:
+            response.raise_for_status()
+            if response.status == 200:
+                # Server ignored the Range header, this is the whole file
+                await self._stream_to_file(response, output_path)
+                return
+
+            total_size = None
+            if response.status == 206 and _content_range_start(response) == 0:
+                total_size = _content_range_total(response)
+            if total_size is not None:
+                first_chunk = await response.read()
+
+        if total_size is None:
+            # Total size unknown ("bytes 0-2097151/*") or an odd range, get it in one go
+            async with await self._get(session, url) as response:
+                response.raise_for_status()
+                await self._stream_to_file(response, output_path)
+            return
+
+        if total_size <= len(first_chunk):
+            # Small file, already complete
+            async with aiofiles.open(output_path, 'wb') as f:
+                await f.write(first_chunk)
+            return
+
+        if not await self._download_ranges(session, url, output_path, first_chunk, total_size):
+            # Server stopped honouring ranges, fall back to a single GET
+            async with await self._get(session, url) as response:
+                response.raise_for_status()
+                await self._stream_to_file(response, output_path)
 
     def extract_if_zip(self, filepath):
         """Extract media files from ZIP if needed (both main and overlay)"""
-        temp_dir = None
         try:
             # Get year from original filepath (e.g., "2025")
             year = str(filepath.relative_to(self.output_dir).parent)
@@ -199,12 +573,14 @@ class SnapchatMemoryDownloader:
             no_filters_folder = self.output_dir / "no_filters" / year
             overlays_folder = self.output_dir / "overlays" / year
 
-            final_folder.mkdir(parents=True, exist_ok=True)
-            no_filters_folder.mkdir(parents=True, exist_ok=True)
-            overlays_folder.mkdir(parents=True, exist_ok=True)
+            self._ensure_dir(final_folder)
+            self._ensure_dir(no_filters_folder)
+            self._ensure_dir(overlays_folder)
 
-            # Check if file is a ZIP
-            if not zipfile.is_zipfile(filepath):
+            # Open as ZIP right away, only the local headers are read
+            try:
+                zip_ref = _MemoryZip(filepath)
+            except zipfile.BadZipFile:
                 # Not a ZIP - this is a regular file without filters
                 # Move it to the final folder (it's the finished version)
                 new_path = final_folder / filepath.name
@@ -213,13 +589,9 @@ class SnapchatMemoryDownloader:
                 shutil.move(str(filepath), str(new_path))
                 return [new_path]
 
-            # Extract the media files
-            temp_dir = filepath.parent / f"_temp_{filepath.stem}"
-            temp_dir.mkdir(exist_ok=True)
-
             extracted_files = []
 
-            with zipfile.ZipFile(filepath, 'r') as zip_ref:
+            with zip_ref:
                 # Get all files in the ZIP
                 files = zip_ref.namelist()
 
@@ -248,37 +620,31 @@ class SnapchatMemoryDownloader:
                 main_filepath = None
                 if main_file:
                     try:
-                        extracted_path = Path(zip_ref.extract(main_file, temp_dir))
-                        actual_ext = extracted_path.suffix
+                        actual_ext = Path(main_file).suffix
 
                         # Save main file to no_filters folder
-                        main_filepath = no_filters_folder / f"{base_filename}{actual_ext}"
+                        destination = no_filters_folder / f"{base_filename}{actual_ext}"
 
-                        if main_filepath.exists():
-                            main_filepath.unlink()
-
-                        if extracted_path.exists():
-                            shutil.move(str(extracted_path), str(main_filepath))
-                            extracted_files.append(main_filepath)
+                        # Stream straight to the destination, no temp copy
+                        zip_ref.extract_to(main_file, destination)
+                        main_filepath = destination
+                        extracted_files.append(main_filepath)
                     except Exception as e:
                         print(f"\nWARNING: Error extracting main file: {e}")
+                        return [filepath]  # Keep the original ZIP
 
                 # Extract overlay file if it exists
                 overlay_filepath = None
                 if overlay_file:
                     try:
-                        extracted_path = Path(zip_ref.extract(overlay_file, temp_dir))
-                        overlay_ext = extracted_path.suffix
+                        overlay_ext = Path(overlay_file).suffix
 
                         # Save overlay to overlays folder
-                        overlay_filepath = overlays_folder / f"{base_filename}{overlay_ext}"
-
-                        if overlay_filepath.exists():
-                            overlay_filepath.unlink()
+                        destination = overlays_folder / f"{base_filename}{overlay_ext}"
 
-                        if extracted_path.exists():
-                            shutil.move(str(extracted_path), str(overlay_filepath))
-                            extracted_files.append(overlay_filepath)
+                        zip_ref.extract_to(overlay_file, destination)
+                        overlay_filepath = destination
+                        extracted_files.append(overlay_filepath)
                     except Exception as e:
                         pass  # Overlay is optional, skip if fails
 
@@ -311,18 +677,6 @@ class SnapchatMemoryDownloader:
         except Exception as e:
             # If extraction fails, keep the original file
             return [filepath]
-        finally:
-            # Clean up temporary extraction directory
-            if temp_dir and temp_dir.exists():
-                shutil.rmtree(temp_dir, ignore_errors=True)
-            
-            # Clean up empty year folder (e.g., downloaded_memories/2025/)
-            year_folder = filepath.parent
-            if year_folder.exists():
-                try:
-                    year_folder.rmdir()  # Only succeeds if empty
-                except OSError:
-                    pass  # Not empty, keep it
 
     def set_file_dates(self, filepath, local_date):
         """Set file creation and modification dates"""
@@ -346,32 +700,102 @@ class SnapchatMemoryDownloader:
             except (FileNotFoundError, subprocess.SubprocessError):
                 pass  # SetFile not available, skip
 
-    def set_exif_data(self, filepath, memory):
-        """Set EXIF data for images using exiftool"""
-        if memory['media_type'].lower() != 'image':
+    def _run_exiftool(self, args):
+        """Run one exiftool command through a single -stay_open process
+
+        Starting exiftool (a Perl program) costs far more than writing the
+        tags, so one process is kept running and fed commands on stdin.
+        """
+        # One argument per line, -execute runs the command
+        command = ['-charset', 'filename=utf8'] + args + ['-execute']
+        command = ('\n'.join(command) + '\n').encode('utf-8')
+
+        with self._exiftool_lock:  # Called from several worker threads
+            # A second try on a fresh process if exiftool died in between
+            for attempt in range(2):
+                if self._exiftool is None:
+                    self._exiftool = subprocess.Popen(
+                        ['exiftool', '-stay_open', 'True', '-@', '-'],
+                        stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL
+                    )
+
+                try:
+                    self._exiftool.stdin.write(command)
+                    self._exiftool.stdin.flush()
+
+                    # exiftool prints {ready} once the command is done
+                    output = []
+                    for line in self._exiftool.stdout:
+                        if line.strip() == b'{ready}':
+                            return b''.join(output)
+                        output.append(line)
+                except OSError:
+                    pass  # Broken pipe, exiftool died between commands
+
+                # exiftool died - reap it, the next attempt starts a new one
+                self._kill_exiftool()
+
+            raise RuntimeError("exiftool exited unexpectedly")
+
+    def _kill_exiftool(self):
+        """Kill and reap the persistent exiftool process"""
+        self._exiftool.kill()
+        self._exiftool.wait()
+        for pipe in [self._exiftool.stdin, self._exiftool.stdout]:
+            try:
+                pipe.close()
+            except OSError:
+                pass  # Unflushed input can't reach a dead process
+        self._exiftool = None
+
+    def _close_exiftool(self):
+        """Stop the persistent exiftool process, if it was started"""
+        if self._exiftool is None:
             return
 
         try:
-            import subprocess
+            self._exiftool.stdin.write(b'-stay_open\nFalse\n')
+            self._exiftool.stdin.close()
+            self._exiftool.wait(timeout=10)
+            self._exiftool.stdout.close()
+            self._exiftool = None
+        except (OSError, subprocess.TimeoutExpired):
+            self._kill_exiftool()
+
+    def set_exif_data(self, filepath, i):
+        """Set EXIF data and file dates for images using exiftool
+
+        Returns True if exiftool updated the file.
+        """
+        memories = self.memories
+        if memories.media_type[i].lower() != 'image':
+            return False
 
-            date = memory['date_local']
+        try:
+            date = memories.date_local[i]
 
             # Format dates for EXIF
             exif_date = date.strftime("%Y:%m:%d %H:%M:%S")
+            offset = date.strftime("%z")  # e.g. +0100
+            file_date = f"{exif_date}{offset[:3]}:{offset[3:]}"
 
             commands = [
-                'exiftool',
                 '-overwrite_original',
                 f'-DateTimeOriginal={exif_date}',
                 f'-CreateDate={exif_date}',
                 f'-ModifyDate={exif_date}',
+                # File dates in the same pass (replaces set_file_dates for images)
+                f'-FileModifyDate={file_date}',
             ]
 
-            # Add GPS data if available
-            if memory['latitude'] and memory['longitude']:
-                lat = memory['latitude']
-                lon = memory['longitude']
+            # On macOS, also set birth time (creation date)
+            if sys.platform == 'darwin':
+                commands.append(f'-FileCreateDate={file_date}')
 
+            # Add GPS data if available
+            lat = memories.latitude[i]
+            lon = memories.longitude[i]
+            if lat and lon:
                 commands.extend([
                     f'-GPSLatitude={abs(lat)}',
                     f'-GPSLatitudeRef={"N" if lat >= 0 else "S"}',
@@ -381,31 +805,34 @@ class SnapchatMemoryDownloader:
 
             commands.append(str(filepath))
 
-            subprocess.run(commands, check=False, capture_output=True)
+            output = self._run_exiftool(commands)
+            return b'1 image files updated' in output
         except Exception as e:
             # exiftool not available or failed, skip
-            pass
+            return False
 
     def merge_image_with_overlay(self, main_image_path, overlay_path, output_path):
         """Merge overlay PNG onto main image using PIL"""
         try:
             # Open both images
-            main_img = Image.open(main_image_path).convert('RGBA')
+            main_img = Image.open(main_image_path)
             overlay_img = Image.open(overlay_path).convert('RGBA')
 
             # Resize overlay to match main image size if needed
             if overlay_img.size != main_img.size:
-                overlay_img = overlay_img.resize(main_img.size, Image.Resampling.LANCZOS)
-
-            # Composite overlay on top of main image
-            merged = Image.alpha_composite(main_img, overlay_img)
+                overlay_img = overlay_img.resize(main_img.size, LANCZOS)
 
-            # Convert back to RGB if saving as JPG
             if output_path.suffix.lower() in ['.jpg', '.jpeg']:
-                merged = merged.convert('RGB')
+                # JPEG photos are opaque - paste with the overlay's alpha as mask
+                # straight in RGB, no RGBA copy of the photo needed
+                merged = main_img.convert('RGB')
+                merged.paste(overlay_img, (0, 0), overlay_img)
+            else:
+                # Composite overlay on top of main image
+                merged = Image.alpha_composite(main_img.convert('RGBA'), overlay_img)
 
             # Save merged image
-            merged.save(output_path, quality=95)
+            merged.save(output_path, quality=95, optimize=False, progressive=False)
             return True
         except Exception as e:
             print(f"\nWARNING: Error merging image: {e}")
@@ -414,29 +841,127 @@ class SnapchatMemoryDownloader:
     def merge_video_with_overlay(self, main_video_path, overlay_path, output_path):
         """Merge overlay PNG onto video using ffmpeg"""
         try:
-            # ffmpeg command to overlay PNG on video
-            cmd = [
-                'ffmpeg',
-                '-i', str(main_video_path),
-                '-i', str(overlay_path),
-                '-filter_complex', '[0:v][1:v]overlay=0:0',
-                '-c:a', 'copy',  # Copy audio without re-encoding
-                '-y',  # Overwrite output file
-                str(output_path)
-            ]
+            result = self._run_ffmpeg_overlay(main_video_path, overlay_path, output_path, self._vcodec)
+
+            if result.returncode != 0 and self._vcodec != 'libx264':
+                # Hardware encoder not usable here, use libx264 from now on
+                result = self._run_ffmpeg_overlay(main_video_path, overlay_path, output_path, 'libx264')
+                if result.returncode == 0:
+                    self._vcodec = 'libx264'
 
-            result = subprocess.run(cmd, capture_output=True, check=False)
             return result.returncode == 0
         except Exception as e:
             print(f"\nWARNING: Error merging video: {e}")
             return False
 
+    def _run_ffmpeg_overlay(self, main_video_path, overlay_path, output_path, vcodec):
+        """Run ffmpeg to overlay a PNG on a video with the given encoder"""
+        # ffmpeg command to overlay PNG on video
+        cmd = [
+            'ffmpeg',
+            '-i', str(main_video_path),
+            '-i', str(overlay_path),
+            '-filter_complex', '[0:v][1:v]overlay=0:0',
+            '-c:v', vcodec,
+        ]
+
+        # Hardware encoders need a bitrate, libx264 picks its own quality
+        if vcodec != 'libx264':
+            cmd.extend(['-b:v', '6M'])
+
+        cmd.extend([
+            '-c:a', 'copy',  # Copy audio without re-encoding
+            '-y',  # Overwrite output file
+            str(output_path)
+        ])
+
+        return subprocess.run(cmd, capture_output=True, check=False)
+
+    def _existing_files(self):
+        """Set of (year, base_name) already downloaded, from one listing per folder"""
+        existing = set()
+        roots = [
+            self.output_dir / "final",
+            self.output_dir / "no_filters",
+            self.output_dir / "overlays",
+            self.output_dir  # Original location before extraction
+        ]
+
+        for root in roots:
+            if not root.is_dir():
+                continue
+            with os.scandir(root) as year_entries:
+                for year_entry in year_entries:
+                    if not (year_entry.is_dir() and year_entry.name.isdigit()):
+                        continue
+                    with os.scandir(year_entry.path) as file_entries:
+                        for file_entry in file_entries:
+                            # Same match as glob(f"{base_name}.*")
+                            base_name, dot, _ = file_entry.name.partition('.')
+                            if dot:
+                                existing.add((year_entry.name, base_name))
+
+        return existing
+
+    def _process_download(self, output_path, i):
+        """Extract, tag and date downloaded memory i (runs in a worker thread)"""
+        # Extract from ZIP if needed (returns list of files)
+        final_paths = self.extract_if_zip(output_path)
+
+        # Process each extracted file (main + overlay)
+        for final_path in final_paths:
+            # Images get EXIF data and file dates in a single exiftool call
+            # Only set EXIF on main file (not overlay)
+            if '_overlay' not in final_path.stem and self.set_exif_data(final_path, i):
+                continue
+
+            # Videos, or exiftool not available
+            self.set_file_dates(final_path, self.memories.date_local[i])
+
+    async def _download_one(self, session, i, output_path, sem, pbar, video_pool):
+        """Download memory i, then post-process it off the event loop"""
+        try:
+            # Only the network part is rate limited, so post-processing of
+            # finished files overlaps with the next downloads
+            async with sem:
+                ok = await self.download_file(session, self.memories.url[i], output_path)
+
+            if ok:
+                # Videos go to their own smaller pool, so ffmpeg merges can't
+                # saturate the CPU or hold up photos waiting to be processed
+                is_video = self.memories.media_type[i].lower() == 'video'
+                loop = asyncio.get_running_loop()
+                await loop.run_in_executor(video_pool if is_video else None,
+                                           self._process_download, output_path, i)
+            return ok
+        finally:
+            pbar.update(1)
+
+    async def _download_all(self, pending, pbar):
+        """Download all (memory index, output_path) pairs concurrently"""
+        sem = asyncio.Semaphore(self.max_concurrency)
+        # One pooled session, so connections (and TLS handshakes) are reused.
+        # Room for every download's range requests to the same CDN host
+        per_host = max(50, self.max_concurrency * RANGE_CONNECTIONS)
+        connector = aiohttp.TCPConnector(limit=0, limit_per_host=per_host, ttl_dns_cache=300)
+
+        # ffmpeg runs in its own process, so threads are enough to run merges
+        # in parallel (no need to pickle the downloader into a process pool)
+        with ThreadPoolExecutor(max_workers=VIDEO_WORKERS, thread_name_prefix='video') as video_pool:
+            async with aiohttp.ClientSession(connector=connector, timeout=REQUEST_TIMEOUT,
+                                             headers={'User-Agent': USER_AGENT}) as session:
+                return await asyncio.gather(*(
+                    self._download_one(session, i, output_path, sem, pbar, video_pool)
+                    for i, output_path in pending
+                ))
+
     def download_all(self, test_mode=False):
         """Download all memories"""
         if not self.memories:
             self.parse_html()
 
-        memories_to_download = self.memories[:5] if test_mode else self.memories
+        memories = self.memories
+        memories_to_download = range(min(5, len(memories)) if test_mode else len(memories))
 
         print(f"\nStarting download...")
         print(f"Output directory: {self.output_dir.absolute()}\n")
@@ -449,68 +974,48 @@ class SnapchatMemoryDownloader:
         with tqdm(total=len(memories_to_download), unit='file',
                   bar_format='{desc}{percentage:3.0f}%|{bar}| {n_fmt}/{total_fmt} [{elapsed}<{remaining}]',
                   desc='Downloading: ') as pbar:
-            for memory in memories_to_download:
-                output_path = self.get_output_path(memory)
-
-                # Check if file already exists in any of the three folders (much faster than rglob)
-                base_name = output_path.stem
-                year = memory['date_local'].strftime("%Y")
-
-                # Check the three possible locations where file might exist
-                possible_locations = [
-                    self.output_dir / "final" / year,
-                    self.output_dir / "no_filters" / year,
-                    self.output_dir / "overlays" / year,
-                    self.output_dir / year  # Original location before extraction
-                ]
-
-                file_exists = False
-                for location in possible_locations:
-                    if location.exists():
-                        matching_files = list(location.glob(f"{base_name}.*"))
-                        if matching_files:
-                            file_exists = True
-                            break
-
-                if file_exists:
+            pending = []
+            existing = self._existing_files()
+
+            for i in memories_to_download:
+                output_path = self.get_output_path(i)
+                key = (output_path.parent.name, output_path.stem)
+
+                # Already downloaded, or the same timestamp twice in the export
+                # (only the first one is kept)
+                if key in existing:
                     skip_count += 1
                     pbar.update(1)
                     continue
 
-                # Download file
-                if self.download_file(memory['url'], output_path):
-                    # Extract from ZIP if needed (returns list of files)
-                    final_paths = self.extract_if_zip(output_path)
-
-                    # Process each extracted file (main + overlay)
-                    for final_path in final_paths:
-                        # Set EXIF data for images FIRST (before file dates)
-                        # Only set EXIF on main file (not overlay)
-                        if '_overlay' not in final_path.stem:
-                            self.set_exif_data(final_path, memory)
-
-                        # Set file dates LAST (after EXIF, so they don't get overwritten)
-                        self.set_file_dates(final_path, memory['date_local'])
-
-                    success_count += 1
-                else:
-                    fail_count += 1
-                    failed_downloads.append({
-                        'date': memory['date_str'],
-                        'type': memory['media_type'],
-                        'url': memory['url']
-                    })
-
-                pbar.update(1)
-
-                # Small delay to avoid rate limiting
-                time.sleep(0.1)
-
-        # Clean up any empty year folders
-        for year_folder in self.output_dir.iterdir():
-            if year_folder.is_dir() and year_folder.name.isdigit():
-                if not any(year_folder.iterdir()):
-                    year_folder.rmdir()
+                existing.add(key)
+                pending.append((i, output_path))
+
+            try:
+                results = asyncio.run(self._download_all(pending, pbar))
+            finally:
+                self._close_exiftool()
+
+        for (i, _), ok in zip(pending, results):
+            if ok:
+                success_count += 1
+            else:
+                fail_count += 1
+                failed_downloads.append({
+                    'date': memories.date_str[i],
+                    'type': memories.media_type[i],
+                    'url': memories.url[i]
+                })
+
+        # Clean up any empty year folders (one scandir pass, no extra stat calls)
+        with os.scandir(self.output_dir) as entries:
+            for entry in entries:
+                if entry.is_dir() and entry.name.isdigit():
+                    with os.scandir(entry.path) as contents:
+                        is_empty = next(contents, None) is None
+                    if is_empty:
+                        os.rmdir(entry.path)
+        self._created_dirs.clear()  # Some of them may be gone now
 
         print("\n" + "=" * 60)
         print(f"Successfully downloaded: {success_count}")